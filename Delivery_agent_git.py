@@ -7,7 +7,7 @@
 # Features:
 #   - GenAI-based priority reasoning
 #   - Manual route reoptimization
-#   - Shared state via local JSON file
+#   - Shared state via local append-only JSONL log
 #   - Auto assignment for delivery boys
 #   - Google Maps–style visualization
 # ---------------------------------------
@@ -15,12 +15,27 @@
 import streamlit as st
 import google.generativeai as genai
 import pandas as pd
-import json
+import numpy as np
+import orjson
 import random
 import os
-from math import radians, sin, cos, sqrt, atan2
+import hashlib
+import hmac
+import queue
+import threading
+import time
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Literal
+from pydantic import BaseModel
+import ijson
 import folium
 from streamlit_folium import st_folium
+from streamlit.logger import get_logger
+
+from routing import route_order
 
 # ---------------------------------------
 # 🔹 Gemini API Setup (Hardcoded)
@@ -28,171 +43,519 @@ from streamlit_folium import st_folium
 API_KEY = "*********"
 genai.configure(api_key=API_KEY)
 
-DATA_FILE = "deliveries.json"
+MODEL_NAME = "gemini-2.0-flash"
+GENAI_CACHE_FILE = "genai_cache.json"
+GENAI_CACHE_SIZE = 64
+
+logger = get_logger(__name__)  # Streamlit-configured, so INFO reaches the server log
+
+DATA_FILE = "deliveries.jsonl"
+LEGACY_DATA_FILE = "deliveries.json"
+COMPACT_RATIO = 4  # rewrite the log on save once it is 4x larger than the new delivery set
+JSON_OPTS = orjson.OPT_SERIALIZE_NUMPY  # rows pulled from DataFrames may carry numpy scalars
+DELIVERY_COLUMNS = [
+    "delivery_id", "item", "location", "lat", "lon",
+    "assigned_agent", "priority_label", "urgency_score", "reason",
+]
 
 # ---------------------------------------
 # 🔹 Utilities
 # ---------------------------------------
-def random_coord(base_lat=22.57, base_lon=88.36):
-    return base_lat + random.uniform(-0.05, 0.05), base_lon + random.uniform(-0.05, 0.05)
+AGENTS = ("Ravi", "Amit", "Suman", "Priya", "Rohit")
+LOCATIONS = ("Salt Lake", "New Town", "Park Street", "Howrah", "Dumdum")
+PRIORITY_LABELS = ("High", "Medium", "Low")
+ITEMS = (
+    "Insulin Vial for Apollo Pharmacy",
+    "Laptop for TechPark Office",
+    "Groceries for South City Mall",
+    "Poster Banners for College Fest",
+    "Blood Pressure Monitor for Clinic",
+)
+AGENT_COLORS = MappingProxyType({
+    "Ravi": "red",
+    "Amit": "blue",
+    "Suman": "green",
+    "Priya": "purple",
+    "Rohit": "orange",
+})
+
+def random_coords(n, base_lat=22.57, base_lon=88.36):
+    return (
+        base_lat + np.random.uniform(-0.05, 0.05, n),
+        base_lon + np.random.uniform(-0.05, 0.05, n),
+    )
+
+def generate_deliveries(items):
+    # One RNG call per field for the whole batch instead of one per delivery.
+    n = len(items)
+    lats, lons = random_coords(n)
+    return pd.DataFrame({
+        "delivery_id": [f"D{i+1}" for i in range(n)],
+        "item": items,
+        "location": np.random.choice(LOCATIONS, n),
+        "lat": lats,
+        "lon": lons,
+        "assigned_agent": np.random.choice(AGENTS, n),
+    })
+
+def _fill_missing(df, col, mask, values):
+    if mask.any():
+        df[col] = df[col].mask(mask, pd.Series(values, index=df.index[mask]))
 
 def sanitize_deliveries(deliveries):
-    safe = []
-    for i, d in enumerate(deliveries):
-        d = d.copy()
-        d.setdefault("delivery_id", f"D{i+1}")
-        d.setdefault("item", f"Package {i+1}")
-        d.setdefault("location", f"Location {i+1}")
-        if "lat" not in d or "lon" not in d:
-            d["lat"], d["lon"] = random_coord()
-        d.setdefault("assigned_agent", random.choice(["Ravi", "Amit", "Suman", "Priya", "Rohit"]))
-        d.setdefault("priority_label", random.choice(["High", "Medium", "Low"]))
-        d.setdefault("urgency_score", random.randint(3, 9))
-        d.setdefault("reason", "Default fallback priority.")
-        safe.append(d)
-    return safe
+    # Accepts records (e.g. raw GenAI output) or a DataFrame; always returns a DataFrame.
+    # Missing cells are found once per column and filled with one batched draw.
+    df = deliveries if isinstance(deliveries, pd.DataFrame) else pd.DataFrame(list(deliveries))
+    df = df.reset_index(drop=True)
+    df = df.reindex(columns=DELIVERY_COLUMNS + [c for c in df.columns if c not in DELIVERY_COLUMNS])
+    pos = np.arange(1, len(df) + 1)
+
+    for col, fmt in (("delivery_id", "D{}"), ("item", "Package {}"), ("location", "Location {}")):
+        mask = df[col].isna()
+        _fill_missing(df, col, mask, [fmt.format(i) for i in pos[mask.to_numpy()]])
+
+    mask = df["lat"].isna() | df["lon"].isna()
+    lats, lons = random_coords(int(mask.sum()))
+    _fill_missing(df, "lat", mask, lats)
+    _fill_missing(df, "lon", mask, lons)
+
+    mask = df["assigned_agent"].isna()
+    _fill_missing(df, "assigned_agent", mask, np.random.choice(AGENTS, int(mask.sum())))
+    mask = df["priority_label"].isna()
+    _fill_missing(df, "priority_label", mask, np.random.choice(PRIORITY_LABELS, int(mask.sum())))
+    mask = df["urgency_score"].isna()
+    _fill_missing(df, "urgency_score", mask, np.random.randint(3, 10, int(mask.sum())))
+    df["urgency_score"] = df["urgency_score"].astype("int64")
+    mask = df["reason"].isna()
+    _fill_missing(df, "reason", mask, ["Default fallback priority."] * int(mask.sum()))
+    return df
+
+# ---------------------------------------
+# 💾 Persistence (append-only JSONL log)
+# ---------------------------------------
+# One JSON object per line:
+#   {"type": "reset"}                                        -> a new delivery set starts
+#   {"type": "delivery", "delivery": {...}}                  -> full record (insert / replace)
+#   {"type": "update", "delivery_id": "...", "fields": {...}} -> partial update
+RESET_RECORD = {"type": "reset"}
+RESET_LINE = orjson.dumps(RESET_RECORD) + b"\n"
+
+def _delivery_frame(records):
+    # Always expose the standard columns, even for an empty or partial store.
+    df = pd.DataFrame(records)
+    return df.reindex(columns=DELIVERY_COLUMNS + [c for c in df.columns if c not in DELIVERY_COLUMNS])
+
+def _read_legacy():
+    with open(LEGACY_DATA_FILE, "rb") as f:
+        return list(ijson.items(f, "item", use_float=True))
+
+def _append_records(records):
+    # Seed a new log from the legacy deliveries.json first, so updates have records to apply to.
+    if not os.path.exists(DATA_FILE) and os.path.exists(LEGACY_DATA_FILE):
+        records = (
+            [RESET_RECORD]
+            + [{"type": "delivery", "delivery": d} for d in _read_legacy()]
+            + list(records)
+        )
+    with open(DATA_FILE, "ab") as f:
+        f.writelines(orjson.dumps(r, option=JSON_OPTS) + b"\n" for r in records)
+
+def append_delivery(d):
+    _append_records([{"type": "delivery", "delivery": d}])
+
+def append_update(delivery_id, fields):
+    _append_records([{"type": "update", "delivery_id": delivery_id, "fields": fields}])
+
+def patch_delivery(delivery_id, fields, current=None):
+    # Write only the fields that actually change; nothing is written for a no-op patch.
+    if current is not None:
+        fields = {k: v for k, v in fields.items() if current.get(k) != v}
+    if fields:
+        append_update(delivery_id, fields)
+    return fields
 
 def save_deliveries(deliveries):
-    with open(DATA_FILE, "w") as f:
-        json.dump(deliveries, f, indent=2)
+    # A new delivery set replaces the old one: one reset marker + one line per record, appended.
+    records = [RESET_RECORD] + [{"type": "delivery", "delivery": d} for d in deliveries.to_dict("records")]
+    payload = b"".join(orjson.dumps(r, option=JSON_OPTS) + b"\n" for r in records)
+    # Once old sets dominate the log, start a fresh file holding only the new set.
+    if os.path.exists(DATA_FILE) and os.path.getsize(DATA_FILE) > COMPACT_RATIO * len(payload):
+        tmp = DATA_FILE + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, DATA_FILE)
+    else:
+        _append_records(records)
+
+def _replay(lines):
+    state = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        rec = orjson.loads(line)
+        kind = rec.get("type")
+        if kind == "reset":
+            state.clear()
+        elif kind == "delivery":
+            d = rec["delivery"]
+            state[d["delivery_id"]] = d
+        elif kind == "update" and rec.get("delivery_id") in state:
+            state[rec["delivery_id"]].update(rec["fields"])
+    return state
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _read_log(path, mtime_ns, size):
+    # Keyed by mtime/size; only the memory-mapped tail after the last reset marker is parsed.
+    if size == 0:
+        return _delivery_frame([])
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = max(mm.rfind(RESET_LINE), 0)
+        state = _replay(mm[start:].splitlines())
+    return _delivery_frame(list(state.values()))
 
 def load_deliveries():
     if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
-    return []
+        stat = os.stat(DATA_FILE)
+        return _read_log(DATA_FILE, stat.st_mtime_ns, stat.st_size)
+    # Backward compat: until the first write migrates it, read the old single-document store.
+    if os.path.exists(LEGACY_DATA_FILE):
+        return _delivery_frame(_read_legacy())
+    return _delivery_frame([])
 
 # ---------------------------------------
 # 🧠 GenAI Agent
 # ---------------------------------------
+PRIORITY_PREAMBLE = """
+You are an intelligent logistics planner.
+Analyze each delivery and assign priorities (High, Medium, Low)
+semantically based on the nature of the item (not rules).
+Return every input delivery with an urgency_score from 1 to 10 and the reason.
+"""
+
+ROUTE_PREAMBLE = """
+You are a route optimization AI.
+Reassign or reroute deliveries if needed based on the manual event given with the input.
+
+Example: If rally or flood affects an area, reassign deliveries to other agents or alter routes.
+
+Return every input delivery with possibly updated 'assigned_agent' and 'reason'.
+"""
+
+class Delivery(BaseModel):
+    delivery_id: str
+    item: str
+    location: str
+    priority_label: Literal["High", "Medium", "Low"]
+    urgency_score: int
+    reason: str
+    lat: float
+    lon: float
+    assigned_agent: str
+
+# Gemini returns schema-conformant JSON directly, no markdown fences to strip.
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": list[Delivery],
+}
+
+def build_model(system_instruction):
+    # The preambles are far below Gemini's minimum context-cache size, so they are sent inline.
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction)
+
+def log_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        logger.info(
+            "Gemini tokens: prompt=%s cached=%s",
+            usage.prompt_token_count,
+            getattr(usage, "cached_content_token_count", 0),
+        )
+
+# Successful GenAI results, keyed by a hash of the exact inputs (LRU, persisted to disk).
+def _load_response_cache():
+    if os.path.exists(GENAI_CACHE_FILE):
+        try:
+            with open(GENAI_CACHE_FILE, "rb") as f:
+                return OrderedDict(orjson.loads(f.read()))
+        except (OSError, ValueError):
+            pass
+    return OrderedDict()
+
+@st.cache_resource
+def _response_cache():
+    # Loaded once per server process and shared by all sessions and worker threads.
+    return _load_response_cache(), threading.Lock()
+
+def response_key(kind, deliveries, manual_event=None):
+    h = hashlib.sha256(kind.encode() + b"\0")
+    h.update(orjson.dumps(deliveries, option=JSON_OPTS | orjson.OPT_SORT_KEYS))
+    h.update(b"\0" + (manual_event or "").encode())
+    return h.hexdigest()
+
+def cached_response(key):
+    cache, lock = _response_cache()
+    with lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    return None
+
+def store_response(key, result, msg):
+    cache, lock = _response_cache()
+    with lock:
+        cache[key] = [result, msg]
+        while len(cache) > GENAI_CACHE_SIZE:
+            cache.popitem(last=False)
+        tmp = GENAI_CACHE_FILE + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(cache, option=JSON_OPTS))
+        os.replace(tmp, GENAI_CACHE_FILE)
+
+def stream_json_items(chunks, cancel=None):
+    # Yields each element of the streamed top-level JSON array as soon as it closes.
+    # Stops reading the stream as soon as cancel is set.
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, "item", use_float=True)
+    for chunk in chunks:
+        if cancel is not None and cancel.is_set():
+            return
+        if not chunk.parts:  # e.g. a trailing finish-reason / safety chunk; .text would raise
+            continue
+        parser.send(chunk.text.encode())
+        yield from items
+        del items[:]
+    parser.close()
+    yield from items
+
 class GenAIAgent:
     def __init__(self):
-        self.model = genai.GenerativeModel("gemini-2.0-flash")
-
-    def analyze_priorities(self, deliveries):
+        self.priority_model = build_model(PRIORITY_PREAMBLE)
+        self.route_model = build_model(ROUTE_PREAMBLE)
+
+    def _generate_records(self, model, prompt, on_record=None, cancel=None):
+        response = model.generate_content(prompt, generation_config=GENERATION_CONFIG, stream=True)
+        records = []
+        for rec in stream_json_items(response, cancel):
+            records.append(rec)
+            if on_record:
+                on_record(rec)
+        if cancel is not None and cancel.is_set():
+            raise RuntimeError("GenAI call stopped")
+        log_usage(response)
+        return records
+
+    def analyze_priorities(self, deliveries, on_record=None, cancel=None):
+        records = deliveries.to_dict("records")
+        key = response_key("priorities", records)
+        hit = cached_response(key)
+        if hit:
+            return pd.DataFrame(hit[0]), hit[1] + " (cached)"
         prompt = f"""
-        You are an intelligent logistics planner.
-        Analyze each delivery and assign priorities (High, Medium, Low)
-        semantically based on the nature of the item (not rules).
-
         Input Deliveries:
-        {json.dumps(deliveries, indent=2)}
-
-        Return JSON like:
-        [
-          {{
-            "delivery_id": "<id>",
-            "item": "<item>",
-            "location": "<location>",
-            "priority_label": "<High|Medium|Low>",
-            "urgency_score": <1-10>,
-            "reason": "<why>",
-            "lat": <float>,
-            "lon": <float>,
-            "assigned_agent": "<agent>"
-          }}
-        ]
+        {orjson.dumps(records, option=JSON_OPTS | orjson.OPT_INDENT_2).decode()}
         """
         try:
-            response = self.model.generate_content(prompt)
-            text = response.text.replace("```json", "").replace("```", "").strip()
-            data = json.loads(text)
-            return data, "✅ GenAI analyzed priorities successfully."
+            data = self._generate_records(self.priority_model, prompt, on_record, cancel)
+            msg = "✅ GenAI analyzed priorities successfully."
+            store_response(key, data, msg)
+            return pd.DataFrame(data), msg
         except Exception as e:
             return sanitize_deliveries(deliveries), f"⚠️ Fallback: {e}"
 
-    def optimize_routes(self, deliveries, manual_event=None):
-        context = f"Manual event: {manual_event}" if manual_event else "No manual event."
+    def optimize_routes(self, deliveries, manual_event=None, on_record=None, cancel=None):
+        records = deliveries.to_dict("records")
+        key = response_key("routes", records, manual_event)
+        hit = cached_response(key)
+        if hit:
+            return pd.DataFrame(hit[0]), hit[1] + " (cached)"
         prompt = f"""
-        You are a route optimization AI.
-        Reassign or reroute deliveries if needed based on this event:
-        "{manual_event if manual_event else 'None'}"
-
-        Example: If rally or flood affects an area, reassign deliveries to other agents or alter routes.
+        Manual event: "{manual_event if manual_event else 'None'}"
 
         Input Deliveries:
-        {json.dumps(deliveries, indent=2)}
-
-        Return valid JSON with possibly updated 'assigned_agent' and 'reason'.
+        {orjson.dumps(records, option=JSON_OPTS | orjson.OPT_INDENT_2).decode()}
         """
         try:
-            response = self.model.generate_content(prompt)
-            text = response.text.replace("```json", "").replace("```", "").strip()
-            optimized = json.loads(text)
-            base_map = {d["delivery_id"]: d for d in deliveries}
-            merged = [{**base_map.get(o["delivery_id"], {}), **o} for o in optimized]
-            return merged, "✅ GenAI re-optimized routes successfully."
+            optimized = self._generate_records(self.route_model, prompt, on_record, cancel)
+            # Right join on delivery_id: optimized values win, gaps come from the current record.
+            base = deliveries.set_index("delivery_id")
+            opt = pd.DataFrame(optimized).set_index("delivery_id")
+            columns = ["delivery_id", *base.columns.union(opt.columns, sort=False)]
+            merged = opt.combine_first(base.reindex(opt.index)).reset_index()[columns]
+            msg = "✅ GenAI re-optimized routes successfully."
+            store_response(key, merged.to_dict("records"), msg)
+            return merged, msg
         except Exception as e:
             return sanitize_deliveries(deliveries), f"⚠️ Optimization fallback: {e}"
 
+@st.cache_resource
+def get_genai_agent():
+    # One agent per server process, not per rerun.
+    return GenAIAgent()
+
 # ---------------------------------------
 # 🗺️ Map
 # ---------------------------------------
-def render_map(deliveries, draw_routes=True):
+POPUP_TMPL = (
+    "<b>{item}</b><br>{location}<br>Priority: {priority_label}<br>"
+    "Agent: {assigned_agent}<br>Reason: {reason}"
+)
+TOOLTIP_TMPL = "{delivery_id}: {item}"
+
+def map_layers(deliveries, draw_routes=True):
+    # Plain-data description of the map: per agent, its FeatureCollection and ordered route.
+    layers = []
+    for agent, agent_deliveries in deliveries.groupby("assigned_agent", sort=False, dropna=False):
+        latlon = agent_deliveries[["lat", "lon"]].to_numpy()
+        route = latlon[route_order(latlon)].tolist() if draw_routes and len(latlon) > 1 else None
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [d["lon"], d["lat"]]},
+                "properties": {"popup": POPUP_TMPL.format_map(d), "tooltip": TOOLTIP_TMPL.format_map(d)},
+            }
+            for d in agent_deliveries.to_dict("records")
+        ]
+        layers.append({
+            "color": AGENT_COLORS.get(agent, "gray"),
+            "name": agent,
+            "geojson": {"type": "FeatureCollection", "features": features},
+            "route": route,
+        })
+    return layers
+
+def build_map(layers):
     m = folium.Map(location=[22.57, 88.36], zoom_start=12)
-    agent_colors = {
-        "Ravi": "red",
-        "Amit": "blue",
-        "Suman": "green",
-        "Priya": "purple",
-        "Rohit": "orange",
-    }
-
-    for agent in set(d["assigned_agent"] for d in deliveries):
-        agent_deliveries = [d for d in deliveries if d["assigned_agent"] == agent]
-        color = agent_colors.get(agent, "gray")
-        coords = []
-
-        for d in agent_deliveries:
-            coords.append((d["lat"], d["lon"]))
-            popup = f"""
-            <b>{d['item']}</b><br>
-            {d['location']}<br>
-            Priority: {d['priority_label']}<br>
-            Agent: {agent}<br>
-            Reason: {d['reason']}
-            """
-            folium.Marker(
-                [d["lat"], d["lon"]],
-                popup=popup,
-                tooltip=f"{d['delivery_id']}: {d['item']}",
-                icon=folium.Icon(color=color),
-            ).add_to(m)
-
-        if draw_routes and len(coords) > 1:
-            folium.PolyLine(coords, color=color, weight=3, opacity=0.6).add_to(m)
-
-    st_folium(m, width=800, height=500)
+
+    for layer in layers:
+        color = layer["color"]
+        # One GeoJSON layer per agent instead of one Marker per delivery.
+        folium.GeoJson(
+            layer["geojson"],
+            name=layer["name"],
+            marker=folium.CircleMarker(radius=8, color=color, fill=True, fill_color=color, fill_opacity=0.8),
+            tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+            popup=folium.GeoJsonPopup(fields=["popup"], labels=False),
+        ).add_to(m)
+
+        if layer["route"]:
+            folium.PolyLine(layer["route"], color=color, weight=3, opacity=0.6).add_to(m)
+
+    return m
+
+def map_key(deliveries, draw_routes=True):
+    h = hashlib.sha256(pd.util.hash_pandas_object(deliveries, index=False).to_numpy().tobytes())
+    h.update(b"routes" if draw_routes else b"markers")
+    h.update(",".join(deliveries.columns).encode())
+    return h.digest()
+
+def render_map(deliveries, draw_routes=True, key=None):
+    # Layer data is reused while the deliveries are unchanged; the Map is built fresh each rerun.
+    cache_key = map_key(deliveries, draw_routes)
+    if st.session_state.get("map_key") == cache_key:
+        layers = st.session_state["map_layers"]
+    else:
+        layers = map_layers(deliveries, draw_routes)
+        st.session_state.update(map_key=cache_key, map_layers=layers)
+    st_folium(build_map(layers), width=800, height=500, key=key)
 
 # ---------------------------------------
 # 🔐 Login
 # ---------------------------------------
+# Passwords are stored as salted BLAKE2b digests: blake2b(password, salt=salt, digest_size=16).
 CREDENTIALS = {
-    "rep": {"password": "rep123", "role": "company"},
-    "ravi": {"password": "ravi123", "role": "agent"},
-    "amit": {"password": "amit123", "role": "agent"},
-    "suman": {"password": "suman123", "role": "agent"},
-    "priya": {"password": "priya123", "role": "agent"},
-    "rohit": {"password": "rohit123", "role": "agent"},
+    "rep": {"salt": "d050cb43f7a9f774dad5adf6df9b0e9f", "hash": "8e316784e04f851b343695974b513b7c", "role": "company"},
+    "ravi": {"salt": "ea60aafd86de7c609850764843be05de", "hash": "d90ce6549128dca7d5e02694e8c21ec6", "role": "agent"},
+    "amit": {"salt": "7cc4a1d82b534d95d4382c015ef351b5", "hash": "ecb9fe47cc7c1df852f605328ae30407", "role": "agent"},
+    "suman": {"salt": "8ddb5ccccde60931dcd6b8ac7538c3ee", "hash": "ec2051281fa147dc66ca783eec5b4c9e", "role": "agent"},
+    "priya": {"salt": "46eecc03ef6feb3dc4e23e0a9d36e112", "hash": "ca54076da29eb27f5a801133f642b2f0", "role": "agent"},
+    "rohit": {"salt": "04a124120db3eaf77fc54137bdda51f7", "hash": "661bb152360d96ab231bcf866b26529a", "role": "agent"},
 }
 
+# Unknown usernames are hashed against this entry too, so they take as long as a wrong password.
+DUMMY_CREDENTIAL = {"salt": "00" * 16, "hash": "00" * 16}
+
+def check_password(username, password):
+    cred = CREDENTIALS.get(username)
+    known = cred is not None
+    if not known:
+        cred = DUMMY_CREDENTIAL
+    digest = hashlib.blake2b(password.encode(), salt=bytes.fromhex(cred["salt"]), digest_size=16).digest()
+    return hmac.compare_digest(digest, bytes.fromhex(cred["hash"])) and known
+
 def login_screen():
     st.title("🔐 AI Logistics Login")
     username = st.text_input("Username").strip().lower()
     password = st.text_input("Password", type="password")
     if st.button("Login"):
-        if username in CREDENTIALS and CREDENTIALS[username]["password"] == password:
+        if check_password(username, password):
             st.session_state["user_role"] = (
                 "Company Representative" if CREDENTIALS[username]["role"] == "company" else "Delivery Boy"
             )
             st.session_state["username"] = username
             st.rerun()
         else:
-            st.error("Invalid credentials. Try rep/rep123 or ravi/ravi123 etc.")
+            st.error("Invalid credentials.")
 
 # ---------------------------------------
 # 🧩 Main App
 # ---------------------------------------
+def live_preview(deliveries):
+    # Upserts streamed GenAI records into a table while the call runs (see run_genai).
+    # Clicking Stop triggers a rerun, which cancels the call without saving.
+    slot = st.empty()
+    with slot.container():
+        st.button("⏹ Stop GenAI")
+        table = st.empty()
+    rows = {d["delivery_id"]: d for d in deliveries.to_dict("records")}
+
+    def on_records(recs):
+        for rec in recs:
+            key = rec.get("delivery_id")
+            rows[key] = {**rows.get(key, {}), **rec}
+        table.dataframe(pd.DataFrame(list(rows.values())))
+
+    return on_records, slot
+
+def run_genai(call, deliveries, *args, show_stale_map=False):
+    # The Gemini call runs in a worker thread; streamed records come back through a queue
+    # because only this thread may touch st. While waiting, the status line is refreshed on
+    # every poll: each st call is a point where Streamlit can stop the run if Stop was clicked.
+    # With show_stale_map, the current map is rendered while the model works.
+    on_records, preview = live_preview(deliveries)
+    status = st.empty()
+    stale_map = st.empty()
+    updates = queue.Queue()
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(call, deliveries, *args, on_record=updates.put, cancel=cancel)
+        if show_stale_map:
+            with stale_map.container():
+                render_map(deliveries, key="stale_map")
+        started = time.monotonic()
+        while not (future.done() and updates.empty()):
+            # Everything that arrived since the last poll goes into one table render.
+            batch = []
+            try:
+                batch.append(updates.get(timeout=0.25))
+                while True:
+                    batch.append(updates.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                on_records(batch)
+            else:
+                status.caption(f"⏳ Waiting for GenAI… {time.monotonic() - started:.0f}s")
+        result = future.result()
+    finally:
+        cancel.set()  # on Stop, the worker stops reading the stream and caches nothing
+        executor.shutdown(wait=False)  # a Stop rerun must not block on the pending call
+    preview.empty()
+    status.empty()
+    stale_map.empty()
+    return result
+
 def main():
     st.set_page_config(page_title="AI Logistics Planner", layout="wide")
     if "user_role" not in st.session_state:
@@ -201,7 +564,7 @@ def main():
 
     role = st.session_state["user_role"]
     username = st.session_state["username"]
-    genai_agent = GenAIAgent()
+    genai_agent = get_genai_agent()
 
     st.sidebar.title("🔄 Actions")
     if st.sidebar.button("Logout"):
@@ -215,47 +578,35 @@ def main():
     if role == "Company Representative":
         st.title("🏢 Company Logistics Dashboard")
 
+        # One read per rerun; every action below updates this frame instead of re-reading the log.
         if st.button("🚚 Generate Deliveries"):
-            items = [
-                "Insulin Vial for Apollo Pharmacy",
-                "Laptop for TechPark Office",
-                "Groceries for South City Mall",
-                "Poster Banners for College Fest",
-                "Blood Pressure Monitor for Clinic",
-            ]
-            deliveries = []
-            for i, item in enumerate(items):
-                lat, lon = random_coord()
-                deliveries.append({
-                    "delivery_id": f"D{i+1}",
-                    "item": item,
-                    "location": random.choice(["Salt Lake", "New Town", "Park Street", "Howrah", "Dumdum"]),
-                    "lat": lat,
-                    "lon": lon,
-                    "assigned_agent": random.choice(["Ravi", "Amit", "Suman", "Priya", "Rohit"])
-                })
-            deliveries = sanitize_deliveries(deliveries)
+            deliveries = sanitize_deliveries(generate_deliveries(list(ITEMS)))
             save_deliveries(deliveries)
             st.success("✅ Deliveries generated and saved successfully.")
+        else:
+            deliveries = load_deliveries()
 
-        deliveries = load_deliveries()
-        if deliveries:
+        if not deliveries.empty:
             st.subheader("📋 Current Deliveries")
-            st.dataframe(pd.DataFrame(deliveries))
+            st.dataframe(deliveries)
 
             if st.button("🧠 Analyze Priorities with GenAI"):
-                prioritized, msg = genai_agent.analyze_priorities(deliveries)
-                save_deliveries(sanitize_deliveries(prioritized))
+                prioritized, msg = run_genai(genai_agent.analyze_priorities, deliveries)
+                deliveries = sanitize_deliveries(prioritized)
+                save_deliveries(deliveries)
                 st.success(msg)
 
             manual_event = st.text_input("⚙️ Manual Event (e.g., 'Rally in Park Street')")
             if st.button("🔁 Optimize Routes (GenAI)"):
-                optimized, msg = genai_agent.optimize_routes(deliveries, manual_event)
-                save_deliveries(sanitize_deliveries(optimized))
+                optimized, msg = run_genai(
+                    genai_agent.optimize_routes, deliveries, manual_event, show_stale_map=True
+                )
+                deliveries = sanitize_deliveries(optimized)
+                save_deliveries(deliveries)
                 st.success(msg)
 
             st.subheader("🗺️ Optimized Delivery Map")
-            render_map(load_deliveries())
+            render_map(deliveries)
 
     # -------------------------------
     # Delivery Boy
@@ -263,22 +614,27 @@ def main():
     else:
         st.title(f"🚴 Delivery Dashboard - {username.capitalize()}")
         deliveries = load_deliveries()
-        assigned = [
-            d for d in deliveries if d.get("assigned_agent", "").lower() == username.lower()
-        ]
+        agents = deliveries["assigned_agent"].fillna("").astype(str).str.lower()
+        assigned = deliveries[agents == username.lower()]
 
-        if not assigned:
+        if assigned.empty:
             st.warning("No deliveries currently assigned to you.")
             # Auto assign one randomly for demonstration
-            if deliveries:
-                random_delivery = random.choice(deliveries)
-                random_delivery["assigned_agent"] = username.capitalize()
-                save_deliveries(deliveries)
+            if not deliveries.empty:
+                idx = random.choice(deliveries.index)
+                random_delivery = deliveries.loc[idx].to_dict()
+                changed = patch_delivery(
+                    random_delivery["delivery_id"],
+                    {"assigned_agent": username.capitalize()},
+                    current=random_delivery,
+                )
+                for field, value in changed.items():
+                    deliveries.at[idx, field] = value
                 st.info(f"✅ Auto-assigned {random_delivery['delivery_id']} to you.")
-                assigned = [random_delivery]
+                assigned = deliveries.loc[[idx]]
 
         st.subheader("📋 Your Deliveries")
-        st.dataframe(pd.DataFrame(assigned))
+        st.dataframe(assigned)
         st.subheader("🗺️ Your Route Map")
         render_map(assigned)
 
@@ -0,0 +1,97 @@
+# routing.py
+# ---------------------------------------
+# Route ordering for the AI Logistics Planner map
+#   - Haversine distance matrix
+#   - Nearest-neighbour tour (+ 2-opt above TWO_OPT_MIN_STOPS)
+# Numba-compiled. Kept in its own importable module so the on-disk
+# kernel cache is keyed by a stable module name ("routing"), whether the
+# app runs via `streamlit run` (as __main__) or is imported.
+# ---------------------------------------
+
+import os
+from math import radians, sin, cos, sqrt, atan2
+import numpy as np
+
+# Compiled kernels are cached next to this module so they ship with the deployment.
+os.environ.setdefault(
+    "NUMBA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".numba_cache")
+)
+from numba import njit  # noqa: E402  (must be imported after NUMBA_CACHE_DIR is set)
+
+EARTH_RADIUS_KM = 6371.0
+TWO_OPT_MIN_STOPS = 12  # refine the greedy tour with 2-opt above this many stops
+FAR_KM = 1e300  # finite "infinity": fastmath lets LLVM assume no inf values
+
+# Explicit signatures compile eagerly at import (or load from NUMBA_CACHE_DIR),
+# so the first map render never pays JIT latency.
+@njit("f8(f8, f8, f8, f8)", cache=True, fastmath=True)
+def _haversine(lat1, lon1, lat2, lon2):
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * atan2(sqrt(a), sqrt(1 - a))
+
+@njit("f8[:, ::1](f8[::1], f8[::1])", cache=True, fastmath=True)
+def _distance_matrix(lats, lons):
+    n = lats.shape[0]
+    dist = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i + 1, n):
+            d = _haversine(lats[i], lons[i], lats[j], lons[j])
+            dist[i, j] = d
+            dist[j, i] = d
+    return dist
+
+@njit("i8[::1](i8[::1], f8[:, ::1])", cache=True, fastmath=True)
+def _two_opt(order, dist):
+    # Open path: the start stop stays fixed, there is no edge back to it.
+    n = order.shape[0]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b, c = order[i - 1], order[i], order[j]
+                delta = dist[a, c] - dist[a, b]
+                if j + 1 < n:
+                    e = order[j + 1]
+                    delta += dist[b, e] - dist[c, e]
+                if delta < -1e-9:
+                    order[i:j + 1] = order[i:j + 1][::-1].copy()
+                    improved = True
+    return order
+
+@njit("i8[::1](f8[::1], f8[::1])", cache=True, fastmath=True)
+def _nn_tour(lats, lons):
+    n = lats.shape[0]
+    order = np.zeros(n, np.int64)
+    if n == 0:
+        return order
+    dist = _distance_matrix(lats, lons)
+    # Visited set as a bitmap, one uint64 word per 64 stops (a single word for typical routes).
+    # The inner scan uses selects instead of data-dependent branches, so it lowers to cmovs.
+    visited = np.zeros((n + 63) >> 6, np.uint64)
+    visited[0] = np.uint64(1)
+    cur = 0
+    for k in range(1, n):
+        best = FAR_KM
+        nxt = 0
+        for j in range(n):
+            seen = (visited[j >> 6] >> np.uint64(j & 63)) & np.uint64(1)
+            d = FAR_KM if seen else dist[cur, j]
+            closer = d < best
+            nxt = j if closer else nxt
+            best = d if closer else best
+        order[k] = nxt
+        visited[nxt >> 6] |= np.uint64(1) << np.uint64(nxt & 63)
+        cur = nxt
+    if n > TWO_OPT_MIN_STOPS:
+        _two_opt(order, dist)
+    return order
+
+def route_order(latlon):
+    # latlon: (n, 2) array of [lat, lon] rows, e.g. df[["lat", "lon"]].to_numpy()
+    # Copies into fresh contiguous arrays: pandas may hand out read-only views,
+    # which don't match the compiled f8[::1] signature.
+    latlon = np.asarray(latlon, dtype=np.float64)
+    return _nn_tour(np.array(latlon[:, 0], order="C"), np.array(latlon[:, 1], order="C"))